@@ -0,0 +1,86 @@
+import argparse
+
+from cost_model import load_jobs, fit_cost_model, choose_scale, CANDIDATE_SCALES, JOB_LOG_PATH
+import cost_model
+
+FIXED_SCALE = 100
+
+
+def request_group(job):
+    """
+    Jobs of the same request, recorded at different scales. Older logs lack the bbox.
+    """
+    if job.get('bbox'):
+        return (tuple(job['bbox']), job.get('start_date'), job.get('end_date'))
+    return (round(job['area_m2']), job['date_span_days'])
+
+
+def record_at_scales(archive, key_path, scales):
+    """
+    Run every request of a replay archive against Earth Engine once per scale,
+    each run appends its measured latency to the job log
+    """
+    from replay import load_exchanges, EXPORT_FIELDS
+    from export_ndvi import run_ndvi_export
+
+    for exchange in load_exchanges(archive):
+        request = exchange['request']
+        for scale in scales:
+            output = run_ndvi_export(*(request[field] for field in EXPORT_FIELDS), key_path=key_path,
+                                     thresholds=request.get('thresholds'), scale=scale)
+            print(f"{request['minLon']:.3f},{request['minLat']:.3f} at {scale} m: {output['duration_seconds']:.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare measured deadline misses at fixed vs. model-chosen scale on held-out requests")
+    parser.add_argument("--log", default=JOB_LOG_PATH)
+    parser.add_argument("--deadline", type=float, default=60.0)
+    parser.add_argument("--train-fraction", type=float, default=0.5)
+    parser.add_argument("--record", metavar="ARCHIVE",
+                        help="First run each request of this replay archive at every candidate scale")
+    parser.add_argument("--key-path", default=None, help="Earth Engine credentials for --record")
+    args = parser.parse_args()
+
+    if args.record:
+        cost_model.JOB_LOG_PATH = args.log
+        record_at_scales(args.record, args.key_path, CANDIDATE_SCALES)
+
+    jobs = [j for j in load_jobs(args.log) if not j.get('progressive')]
+    groups = {}
+    for job in jobs:
+        groups.setdefault(request_group(job), {})[job['scale']] = job
+    # Only requests measured at every candidate scale can be scored without the model
+    complete = [key for key, by_scale in groups.items() if all(s in by_scale for s in CANDIDATE_SCALES)]
+    split = int(len(complete) * args.train_fraction)
+    held_out = set(complete[split:])
+    if not held_out:
+        parser.error(f"No requests in {args.log} recorded at all of {CANDIDATE_SCALES} m, "
+                     "record some with --record ARCHIVE")
+    # Fit on everything except the held-out requests
+    train = [j for j in jobs if request_group(j) not in held_out]
+    coefficients = fit_cost_model(train)
+
+    misses = {scale: 0 for scale in CANDIDATE_SCALES}
+    adaptive_misses = 0
+    chosen = {}
+    for key in held_out:
+        by_scale = groups[key]
+        for scale in CANDIDATE_SCALES:
+            misses[scale] += by_scale[scale]['duration_seconds'] > args.deadline
+        job = by_scale[FIXED_SCALE]
+        scale, _ = choose_scale(job['area_m2'], job['date_span_days'], args.deadline, coefficients)
+        chosen[scale] = chosen.get(scale, 0) + 1
+        adaptive_misses += by_scale[scale]['duration_seconds'] > args.deadline
+
+    n = len(held_out)
+    print(f"Fitted on {len(train)} jobs, scored {n} held-out requests "
+          f"with a {args.deadline:.0f} s deadline")
+    print(f"Coefficients: {', '.join(f'{c:.4g}' for c in coefficients)}")
+    print("Misses are measured: each held-out request was recorded at every scale")
+    print(f"{'mode':<14}{'misses':>8}{'miss rate':>11}")
+    for scale in CANDIDATE_SCALES:
+        name = f"fixed {scale} m"
+        print(f"{name:<14}{misses[scale]:>8}{misses[scale] / n:>11.1%}")
+    print(f"{'adaptive':<14}{adaptive_misses:>8}{adaptive_misses / n:>11.1%}")
+    print("Chosen scales: " + ", ".join(f"{s} m x{c}" for s, c in sorted(chosen.items())))
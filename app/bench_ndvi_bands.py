@@ -0,0 +1,57 @@
+import time
+import argparse
+
+import ee
+
+from export_ndvi import run_ndvi_export
+
+ee_calls = {'count': 0}
+
+
+def count_ee_calls():
+    """
+    Wrap ee.data.computeValue (used by getInfo) so each server round trip is counted
+    """
+    compute_value = ee.data.computeValue
+
+    def counted(*args, **kwargs):
+        ee_calls['count'] += 1
+        return compute_value(*args, **kwargs)
+
+    ee.data.computeValue = counted
+
+
+def timed_runs(args, threshold_sets):
+    ee_calls['count'] = 0
+    start = time.time()
+    zones = 0
+    for thresholds in threshold_sets:
+        output = run_ndvi_export(*args, thresholds=thresholds)
+        zones += output['count']
+    return time.time() - start, ee_calls['count'], zones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare one banded export against one export per threshold")
+    parser.add_argument("minLon")
+    parser.add_argument("minLat")
+    parser.add_argument("maxLon")
+    parser.add_argument("maxLat")
+    parser.add_argument("start_date")
+    parser.add_argument("end_date")
+    parser.add_argument("min_area")
+    parser.add_argument("key_path", nargs="?", default=None)
+    parser.add_argument("--thresholds", default="0.3,0.45,0.6")
+    args = parser.parse_args()
+
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    export_args = (args.minLon, args.minLat, args.maxLon, args.maxLat,
+                   args.start_date, args.end_date, args.min_area, args.key_path)
+
+    count_ee_calls()
+    banded = timed_runs(export_args, [thresholds])
+    separate = timed_runs(export_args, [[t] for t in thresholds])
+
+    print(f"{'mode':<12}{'seconds':>10}{'EE calls':>10}{'zones':>8}")
+    print(f"{'banded':<12}{banded[0]:>10.2f}{banded[1]:>10}{banded[2]:>8}")
+    print(f"{'separate':<12}{separate[0]:>10.2f}{separate[1]:>10}{separate[2]:>8}")
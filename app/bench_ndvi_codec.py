@@ -0,0 +1,52 @@
+import base64
+import zlib
+import argparse
+
+from ndvi_codec import (
+    read_payload_corpus, decompress_ndvi_payload, compress_ndvi_payload, load_preset_dict,
+    SCHEME_STORED, SCHEME_DEFLATE, SCHEME_DEFLATE_DICT, SCHEME_LZMA
+)
+
+SMS_SEGMENT_CHARS = 160
+
+SCHEMES = {
+    'stored': (SCHEME_STORED,),
+    'deflate': (SCHEME_DEFLATE,),
+    'deflate_dict': (SCHEME_DEFLATE_DICT,),
+    'lzma': (SCHEME_LZMA,),
+    'best': (SCHEME_STORED, SCHEME_DEFLATE, SCHEME_DEFLATE_DICT, SCHEME_LZMA),
+}
+
+
+def b85_len(n_bytes):
+    return (n_bytes * 5 + 3) // 4
+
+
+def sms_segments(n_chars):
+    return -(-n_chars // SMS_SEGMENT_CHARS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare payload sizes of the NDVI compression schemes")
+    parser.add_argument("corpus", nargs="+", help="Files or directories with one base85 payload per line")
+    parser.add_argument("--dict", dest="dict_path", default=None, help="Preset dictionary file")
+    args = parser.parse_args()
+
+    preset_dict = load_preset_dict(args.dict_path)
+    payloads = read_payload_corpus(args.corpus)
+    samples = [decompress_ndvi_payload(base64.b85decode(p), preset_dict) for p in payloads]
+
+    totals = {'legacy_zlib': [len(zlib.compress(s)) for s in samples]}
+    for name, schemes in SCHEMES.items():
+        if name == 'deflate_dict' and preset_dict is None:
+            continue
+        totals[name] = [len(compress_ndvi_payload(s, schemes, preset_dict)) for s in samples]
+
+    print(f"{len(samples)} payloads, {sum(len(s) for s in samples)} raw bytes, "
+          f"dictionary: {'none' if preset_dict is None else f'v{preset_dict[0]} ({len(preset_dict[1])} bytes)'}")
+    print(f"{'scheme':<14}{'bytes':>10}{'b85 chars':>12}{'SMS parts':>12}{'vs legacy':>12}")
+    legacy_chars = sum(b85_len(n) for n in totals['legacy_zlib'])
+    for name, sizes in totals.items():
+        chars = sum(b85_len(n) for n in sizes)
+        parts = sum(sms_segments(b85_len(n)) for n in sizes)
+        print(f"{name:<14}{sum(sizes):>10}{chars:>12}{parts:>12}{chars / legacy_chars:>11.1%}")
@@ -0,0 +1,63 @@
+import os
+import time
+import random
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from export_ndvi import postprocess_features
+
+
+def synthetic_feature_collection(seed, n_features=10, n_steps=60, ref_point=(36.8, 2.5)):
+    """
+    Rectilinear 100 m pixel-edge polygons like reduceToVectors returns, around ref_point
+    """
+    rng = random.Random(seed)
+    step = 100 / 111320  # ~100 m in degrees near the equator
+    features = []
+    for _ in range(n_features):
+        x = ref_point[0] + rng.uniform(-0.05, 0.05)
+        y = ref_point[1] + rng.uniform(-0.05, 0.05)
+        ring = [(x, y)]
+        # Random staircase out to the east and back west on a lower row
+        for i in range(n_steps):
+            x += step if i % 2 == 0 else 0
+            y += 0 if i % 2 == 0 else rng.choice((-step, step))
+            ring.append((x, y))
+        for i in range(n_steps):
+            x -= step if i % 2 == 0 else 0
+            y -= 0 if i % 2 == 0 else rng.choice((step, 2 * step))
+            ring.append((x, y))
+        ring.append(ring[0])
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+            'properties': {'mean_ndvi': rng.uniform(0.3, 0.7), 'area': rng.uniform(1e4, 1e6), 'ndvi_zone': 1}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def throughput(n_processes, jobs, ref_point):
+    with ProcessPoolExecutor(max_workers=n_processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Warm up every process so import time isn't counted
+        list(pool.map(postprocess_features, jobs[:n_processes], [ref_point] * n_processes))
+        start = time.time()
+        list(pool.map(postprocess_features, jobs, [ref_point] * len(jobs)))
+        return len(jobs) / (time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-processing throughput from 1 to N processes")
+    parser.add_argument("--max-processes", type=int, default=os.cpu_count())
+    parser.add_argument("--jobs", type=int, default=200)
+    args = parser.parse_args()
+
+    ref_point = (36.8, 2.5)
+    jobs = [synthetic_feature_collection(seed, ref_point=ref_point) for seed in range(args.jobs)]
+
+    print(f"{'processes':>10}{'jobs/s':>10}{'speedup':>10}")
+    baseline = None
+    for n in range(1, args.max_processes + 1):
+        rate = throughput(n, jobs, ref_point)
+        baseline = baseline or rate
+        print(f"{n:>10}{rate:>10.1f}{rate / baseline:>9.2f}x")
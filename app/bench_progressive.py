@@ -0,0 +1,32 @@
+import argparse
+
+from export_ndvi import run_ndvi_export
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare progressive coarse-to-fine evaluation against a full-resolution pass")
+    parser.add_argument("minLon")
+    parser.add_argument("minLat")
+    parser.add_argument("maxLon")
+    parser.add_argument("maxLat")
+    parser.add_argument("start_date")
+    parser.add_argument("end_date")
+    parser.add_argument("min_area")
+    parser.add_argument("key_path", nargs="?", default=None)
+    parser.add_argument("--coarse-scale", type=int, default=1000)
+    args = parser.parse_args()
+
+    export_args = (args.minLon, args.minLat, args.maxLon, args.maxLat,
+                   args.start_date, args.end_date, args.min_area, args.key_path)
+
+    full = run_ndvi_export(*export_args)
+    progressive = run_ndvi_export(*export_args, progressive=True, coarse_scale=args.coarse_scale)
+
+    print(f"{'mode':<13}{'seconds':>10}{'processed px':>14}{'vectorized px':>15}{'zones':>8}")
+    for name, output in (('full', full), ('progressive', progressive)):
+        print(f"{name:<13}{output['duration_seconds']:>10.2f}{output['pixels_processed']:>14}"
+              f"{output['pixels_vectorized']:>15}{output['count']:>8}")
+    coarse = progressive['coarse']
+    print(f"Coarse pass kept {coarse['cells']} cell regions covering {coarse['area_ha']:.0f} ha")
+    if full['compressed'] != progressive['compressed']:
+        print("Warning: progressive result differs from the full-resolution result")
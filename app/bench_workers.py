@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def http(method, url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def wait_for_server(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if http('GET', f"{base_url}/ping")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+def request_bodies(n_requests, duplicates, seed=0):
+    """
+    n_requests POST bodies over n_requests / duplicates distinct bboxes, shuffled
+    """
+    rng = random.Random(seed)
+    distinct = max(n_requests // duplicates, 1)
+    bodies = []
+    for i in range(n_requests):
+        k = i % distinct
+        minLon, minLat = 36.5 + 0.01 * k, 2.3
+        bodies.append({
+            'minLon': minLon, 'minLat': minLat, 'maxLon': minLon + 0.1, 'maxLat': minLat + 0.1,
+            'start_date': '2025-06-01', 'end_date': '2025-07-01', 'min_area': 10000,
+            'mobile': f"2547000{i:05d}",
+        })
+    rng.shuffle(bodies)
+    return bodies, distinct
+
+
+def run_load(n_workers, bodies, concurrency, port, ee_seconds):
+    state_dir = tempfile.mkdtemp(prefix="ndvi-workers-bench-")
+    env = dict(os.environ, NDVI_REPLAY_STATE_DIR=state_dir, NDVI_STUB_EE_SECONDS=str(ee_seconds))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "replay_server:app", "--port", str(port),
+         "--workers", str(n_workers), "--log-level", "warning"],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_server(base_url)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            job_ids = set(body['job_id'] for _, body in pool.map(
+                lambda b: http('POST', f"{base_url}/ndvi", b), bodies))
+        # A job shows up once some worker claims it, finished ones are 'done' or 'failed'
+        pending = set(job_ids)
+        while pending:
+            for job_id in list(pending):
+                status, job = http('GET', f"{base_url}/jobs/{job_id}")
+                if status == 200 and job['status'] != 'running':
+                    pending.discard(job_id)
+            time.sleep(0.05)
+        elapsed = time.time() - start
+    finally:
+        server.terminate()
+        server.wait()
+    with open(os.path.join(state_dir, "exports.log")) as f:
+        exports_run = sum(1 for _ in f)
+    return elapsed, exports_run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Concurrent POST /ndvi load against uvicorn --workers 1..N with Earth Engine stubbed")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--duplicates", type=int, default=2, help="Times each distinct request is sent")
+    parser.add_argument("--concurrency", type=int, default=16, help="Client threads posting requests")
+    parser.add_argument("--ee-seconds", type=float, default=0.0,
+                        help="Also run with this simulated Earth Engine wait per export, reported separately")
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    bodies, distinct = request_bodies(args.requests, args.duplicates)
+    print(f"{len(bodies)} requests, {distinct} distinct")
+    # With no Earth Engine wait, throughput is bounded by the CPU stage of each worker process.
+    # A simulated wait is bounded by executor threads instead (2 per worker), even on one core.
+    passes = [(0.0, "CPU stage, no Earth Engine wait")]
+    if args.ee_seconds > 0:
+        passes.append((args.ee_seconds, f"{args.ee_seconds} s simulated Earth Engine wait, "
+                                        "scales with executor threads rather than cores"))
+    for ee_seconds, label in passes:
+        print(f"\n{label}")
+        print(f"{'workers':>8}{'seconds':>10}{'req/s':>8}{'speedup':>9}{'exports run':>13}")
+        baseline = None
+        for n in range(1, args.max_workers + 1):
+            elapsed, exports_run = run_load(n, bodies, args.concurrency, args.port, ee_seconds)
+            rate = len(bodies) / elapsed
+            baseline = baseline or rate
+            print(f"{n:>8}{elapsed:>10.2f}{rate:>8.1f}{rate / baseline:>8.2f}x{exports_run:>8}/{distinct}")
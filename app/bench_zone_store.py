@@ -0,0 +1,62 @@
+import math
+import time
+import random
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+from zone_store import append_zones, query_trends, trend_sms
+
+EPSG = 32637
+
+
+def synthetic_zone(rng, cx, cy, half):
+    """
+    Rectangle of grid cells around (cx, cy) with a notch, jittered by a cell like real reruns
+    """
+    jx, jy = rng.randint(-1, 1), rng.randint(-1, 1)
+    x0, y0, x1, y1 = cx - half + jx, cy - half + jy, cx + half + jx, cy + half + jy
+    return [(x0, y0), (x1, y0), (x1, y1), (cx + jx, y1), (cx + jx, cy + jy), (x0, cy + jy), (x0, y0)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append a year of synthetic daily exports, then time trend queries")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--zones", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="zone-store-bench-")
+    rng = random.Random(0)
+    first_day = date(2025, 1, 1)
+    centres = [(3000 + rng.randint(0, 400), 500 + rng.randint(0, 400), rng.randint(5, 15)) for _ in range(args.zones)]
+
+    start = time.time()
+    zone_ids = set()
+    for d in range(args.days):
+        end_day = first_day + timedelta(days=d)
+        season = math.sin(2 * math.pi * d / 365)
+        zones = [{
+            'mean_ndvi': 0.45 + 0.15 * season + rng.gauss(0, 0.02),
+            'area_ha': (2 * half) ** 2 * 0.75,
+            'band': 1,
+            'vertices': synthetic_zone(rng, cx, cy, half),
+        } for cx, cy, half in centres]
+        zone_ids.update(append_zones(EPSG, zones, end_day - timedelta(days=14), end_day, root))
+    append_seconds = time.time() - start
+    print(f"Appended {args.days * args.zones} zone rows in {append_seconds:.2f} s "
+          f"({append_seconds / args.days * 1000:.1f} ms per export), {len(zone_ids)} distinct zones")
+
+    last_day = first_day + timedelta(days=args.days - 1)
+    for window in (30, 365):
+        latencies = []
+        for _ in range(args.queries):
+            cx, cy, half = rng.choice(centres)
+            t = time.perf_counter()
+            trends = query_trends(EPSG, cx - 50, cy - 50, cx + 50, cy + 50, last_day - timedelta(days=window), last_day, root)
+            trend_sms(trends)
+            latencies.append((time.perf_counter() - t) * 1000)
+        latencies.sort()
+        print(f"{window:>3} day trend query: p50 {latencies[len(latencies) // 2]:.2f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)]:.2f} ms")
+    print(trend_sms(trends))
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+from collections import deque
+
+
+JOB_LOG_PATH = os.getenv("NDVI_JOB_LOG", os.path.join("output", "ndvi_jobs.jsonl"))
+CANDIDATE_SCALES = (100, 200, 500)
+# Fewer recorded jobs than this and the fit is too noisy, the prior is used instead
+MIN_FIT_SAMPLES = 8
+# Only the most recent jobs are fitted, so refits stay cheap as the log grows
+MAX_FIT_JOBS = int(os.getenv("NDVI_COST_MODEL_JOBS", "500"))
+FIT_FIELDS = ('area_m2', 'date_span_days', 'scale', 'duration_seconds')
+
+# latency = c0 + c1 * megapixels + c2 * megapixels * date_span_days
+# Prior from a handful of manual runs, used until enough jobs are recorded
+PRIOR_COEFFICIENTS = (15.0, 2.0, 0.1)
+
+_fit_cache = {}
+
+
+def job_features(area_m2, date_span_days, scale):
+    """
+    Model inputs known before a run: pixel count at this scale and the date window length
+    """
+    megapixels = area_m2 / scale ** 2 / 1e6
+    return [1.0, megapixels, megapixels * date_span_days]
+
+
+def record_job(record, path=None):
+    """
+    Append one job's features and stage timings to the log
+    """
+    path = path or JOB_LOG_PATH
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = dict(record, recorded_at=time.time())
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def load_jobs(path=None, limit=None):
+    """
+    Recorded jobs, oldest first, the last limit of them if given. Torn lines are skipped.
+    """
+    path = path or JOB_LOG_PATH
+    if not os.path.exists(path):
+        return []
+    jobs = deque(maxlen=limit)
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(job, dict) and all(job.get(field) is not None for field in FIT_FIELDS):
+                jobs.append(job)
+    return list(jobs)
+
+
+def _solve(a, b):
+    # Gaussian elimination with partial pivoting, a is n x n
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(col + 1, n):
+            factor = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= factor * m[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def fit_cost_model(jobs):
+    """
+    Least-squares fit of the latency model, returns coefficients or the prior
+    """
+    if len(jobs) < MIN_FIT_SAMPLES:
+        return PRIOR_COEFFICIENTS
+    xs = [job_features(j['area_m2'], j['date_span_days'], j['scale']) for j in jobs]
+    ys = [j['duration_seconds'] for j in jobs]
+    n = len(xs[0])
+    # Normal equations X^T X c = X^T y, with a little ridge so collinear logs still solve
+    xtx = [[sum(x[i] * x[k] for x in xs) + (1e-6 if i == k else 0.0) for k in range(n)] for i in range(n)]
+    xty = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(n)]
+    coefficients = _solve(xtx, xty)
+    if coefficients is None:
+        return PRIOR_COEFFICIENTS
+    # Negative terms would predict faster runs for larger jobs
+    return tuple(max(c, 0.0) for c in coefficients)
+
+
+def load_cost_model(path=None):
+    """
+    Fitted coefficients for the current job log, refit only when the log changes
+    """
+    path = path or JOB_LOG_PATH
+    try:
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        cached = _fit_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            # Progressive runs skip most of the bbox, so they don't fit the full-pass model
+            jobs = [j for j in load_jobs(path, MAX_FIT_JOBS) if not j.get('progressive')]
+            cached = (mtime, fit_cost_model(jobs))
+            _fit_cache[path] = cached
+        return cached[1]
+    except Exception as e:
+        # The model only tunes the scale, an unreadable log must not fail the export
+        print(f"Failed to load the cost model, using the prior: {e}")
+        return PRIOR_COEFFICIENTS
+
+
+def predict_latency(coefficients, area_m2, date_span_days, scale):
+    return sum(c * x for c, x in zip(coefficients, job_features(area_m2, date_span_days, scale)))
+
+
+def choose_scale(area_m2, date_span_days, deadline_seconds, coefficients=None, scales=CANDIDATE_SCALES):
+    """
+    Finest scale predicted to finish within the deadline, else the coarsest one.
+    Returns (scale, predicted_seconds).
+    """
+    if coefficients is None:
+        coefficients = load_cost_model()
+    for scale in sorted(scales):
+        predicted = predict_latency(coefficients, area_m2, date_span_days, scale)
+        if predicted <= deadline_seconds:
+            return scale, predicted
+    scale = max(scales)
+    return scale, predict_latency(coefficients, area_m2, date_span_days, scale)
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import hashlib
+
+
+# Shared by every uvicorn worker on the host, so all of them see the same
+# result cache and in-flight jobs.
+STATE_DB_PATH = os.getenv("NDVI_STATE_DB", os.path.join("output", "ndvi_state.db"))
+RESULT_TTL_SECONDS = float(os.getenv("NDVI_RESULT_TTL_SECONDS", 6 * 3600))
+# Backstop for fingerprinted results, in case a change the fingerprint doesn't cover slips by
+RESULT_MAX_AGE_SECONDS = float(os.getenv("NDVI_RESULT_MAX_AGE_SECONDS", 7 * 24 * 3600))
+# A running job not updated for this long is treated as dead (worker crashed)
+JOB_STALE_SECONDS = float(os.getenv("NDVI_JOB_STALE_SECONDS", 15 * 60))
+
+_connections = {}
+
+
+def get_connection(path=None):
+    """
+    One connection per process, thread and database path, WAL so readers never block the writer
+    """
+    path = path or STATE_DB_PATH
+    key = (os.getpid(), threading.get_ident(), path)
+    if key not in _connections:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+        try:
+            # Databases created before scene-aware caching lack the fingerprint column
+            conn.execute("ALTER TABLE results ADD COLUMN fingerprint TEXT")
+        except sqlite3.OperationalError:
+            pass
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scene_lists (
+                tile TEXT PRIMARY KEY,
+                scenes TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                pid INTEGER,
+                error TEXT,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        _connections[key] = conn
+    return _connections[key]
+
+
+def job_key(params):
+    """
+    Stable key for the export parameters of a request (everything except the mobile number)
+    """
+    blob = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def get_cached_result(key, fingerprint=None, path=None):
+    """
+    Cached result for the key. With a scene fingerprint the result stays valid while
+    the fingerprint matches, up to RESULT_MAX_AGE_SECONDS. Without one it expires
+    after RESULT_TTL_SECONDS.
+    """
+    row = get_connection(path).execute(
+        "SELECT value, created_at, fingerprint FROM results WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    if fingerprint is not None:
+        if row[2] != fingerprint or time.time() - row[1] > RESULT_MAX_AGE_SECONDS:
+            return None
+    elif time.time() - row[1] > RESULT_TTL_SECONDS:
+        return None
+    return json.loads(row[0])
+
+
+def has_cached_result(key, path=None):
+    """
+    Whether a result is stored and not stale. Results stored with a scene fingerprint
+    count as cached until the scenes change, which only the caller can check, or
+    until RESULT_MAX_AGE_SECONDS.
+    """
+    row = get_connection(path).execute(
+        "SELECT created_at, fingerprint FROM results WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return False
+    max_age = RESULT_MAX_AGE_SECONDS if row[1] is not None else RESULT_TTL_SECONDS
+    return time.time() - row[0] <= max_age
+
+
+def store_result(key, result, fingerprint=None, path=None):
+    get_connection(path).execute(
+        "INSERT OR REPLACE INTO results (key, value, created_at, fingerprint) VALUES (?, ?, ?, ?)",
+        (key, json.dumps(result), time.time(), fingerprint))
+
+
+def get_scene_lists(tiles, max_age, path=None):
+    """
+    Cached [scene_id, time_start_ms] lists for the tiles fetched within max_age seconds
+    """
+    conn = get_connection(path)
+    scene_lists = {}
+    for tile in tiles:
+        row = conn.execute("SELECT scenes, fetched_at FROM scene_lists WHERE tile = ?", (tile,)).fetchone()
+        if row is not None and time.time() - row[1] <= max_age:
+            scene_lists[tile] = json.loads(row[0])
+    return scene_lists
+
+
+def store_scene_lists(scene_lists, path=None):
+    conn = get_connection(path)
+    now = time.time()
+    for tile, scenes in scene_lists.items():
+        conn.execute("INSERT OR REPLACE INTO scene_lists (tile, scenes, fetched_at) VALUES (?, ?, ?)",
+                     (tile, json.dumps(scenes), now))
+
+
+def claim_job(key, path=None):
+    """
+    Mark the job as running for this process. Returns False if another live
+    worker already owns it, in which case the caller should wait for its result.
+    """
+    conn = get_connection(path)
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT status, updated_at FROM jobs WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] == 'running' and now - row[1] < JOB_STALE_SECONDS:
+            conn.execute("COMMIT")
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (key, status, pid, error, started_at, updated_at) "
+            "VALUES (?, 'running', ?, NULL, ?, ?)",
+            (key, os.getpid(), now, now))
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def finish_job(key, error=None, path=None):
+    get_connection(path).execute(
+        "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE key = ?",
+        ('failed' if error else 'done', error, time.time(), key))
+
+
+def get_job(key, path=None):
+    row = get_connection(path).execute(
+        "SELECT status, pid, error, started_at, updated_at FROM jobs WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    status, pid, error, started_at, updated_at = row
+    return {'job_id': key, 'status': status, 'pid': pid, 'error': error,
+            'started_at': started_at, 'updated_at': updated_at}
+
+
+async def wait_for_result(key, fingerprint=None, timeout=JOB_STALE_SECONDS, poll_seconds=1.0, path=None):
+    """
+    Poll until the owning worker stores a result, returns None if the job failed or timed out.
+    Pass the caller's scene fingerprint so a result from before new scenes isn't taken.
+    Waits on the event loop, so waiters don't hold the threads that run exports.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = get_cached_result(key, fingerprint, path=path)
+        if result is not None:
+            return result
+        job = get_job(key, path)
+        if job is None or job['status'] != 'running':
+            return None
+        await asyncio.sleep(poll_seconds)
+    return None
@@ -1,14 +1,22 @@
 import os
 import json
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pprint import pprint
+from datetime import date
 
 import requests
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
+from pydantic import BaseModel, field_validator
 
-from export_ndvi import run_ndvi_export
+from export_ndvi import run_ndvi_export, normalize_thresholds
+from replay import RECORD_PATH, record_exchange
+from scene_index import scene_fingerprint
+from zone_store import append_export, zone_trends, trend_sms
+from job_store import (job_key, get_cached_result, has_cached_result, store_result, claim_job, finish_job, get_job,
+                       wait_for_result)
 
 app = FastAPI()
 
@@ -23,7 +31,20 @@ TEXTSMS_SHORTCODE = textsms_creds["shortcode"]
 
 TEXTSMS_SEND_URL = "https://sms.textsms.co.ke/api/services/sendsms/"
 
+# Default latency budget used to pick the export scale, unset keeps the fixed 100 m scale
+NDVI_DEADLINE_SECONDS = os.getenv("NDVI_DEADLINE_SECONDS")
+# Reuse cached results until a new usable Sentinel-2 scene lands, instead of a fixed TTL
+SCENE_AWARE_CACHE = os.getenv("NDVI_SCENE_AWARE_CACHE", "1") == "1"
+# Longest window /trend accepts, ten years of history
+TREND_MAX_DAYS = 3650
+
 executor = ThreadPoolExecutor(max_workers=2)
+# Shapely/pyproj post-processing and payload encoding run here so they don't hold
+# the GIL of the worker serving requests. Spawn avoids forking a threaded process.
+process_pool = ProcessPoolExecutor(
+    max_workers=int(os.getenv("NDVI_CPU_PROCESSES", "1")),
+    mp_context=multiprocessing.get_context("spawn"),
+)
 
 
 class NdviRequest(BaseModel):
@@ -35,6 +56,19 @@ class NdviRequest(BaseModel):
     end_date: str
     min_area: float
     mobile: str
+    # Optional NDVI band thresholds, e.g. [0.3, 0.5] for "fair" and "good" pasture
+    thresholds: Optional[List[float]] = None
+    # Coarse-to-fine evaluation that skips barren cells, optionally texting the coarse answer first
+    progressive: bool = False
+    early_sms: bool = False
+    # Latency budget, the exporter picks the finest scale predicted to meet it
+    deadline_seconds: Optional[float] = None
+
+    # Reject bad thresholds with a 422 instead of failing later in the background task
+    @field_validator("thresholds")
+    @classmethod
+    def check_thresholds(cls, thresholds):
+        return None if thresholds is None else normalize_thresholds(thresholds)
 
 
 def send_sms(mobile: str, message: str) -> bool:
@@ -54,19 +88,106 @@ def send_sms(mobile: str, message: str) -> bool:
         return False
 
 
-async def run_ndvi_and_notify(request: NdviRequest):
+def request_job_key(request: NdviRequest) -> str:
+    return job_key(request.model_dump(exclude={"mobile", "early_sms"}))
+
+
+def coarse_sms_callback(mobile: str):
+    def send_coarse_sms(coarse: dict):
+        # With no candidate cells the final answer follows immediately, no need for two messages
+        if coarse["cells"] == 0:
+            return
+        message = (f"Early estimate: {coarse['qualifying_area_ha']:.0f} ha of green pasture "
+                   f"in {coarse['cells']} areas, max NDVI {coarse['max_ndvi']:.2f}. Details to follow.")
+        send_sms(mobile, message)
+    return send_coarse_sms
+
+
+def lookup_or_claim(request: NdviRequest):
+    """
+    Returns (key, fingerprint, cached result or None, whether this worker claimed the job)
+    """
+    key = request_job_key(request)
+    fingerprint = None
+    if SCENE_AWARE_CACHE:
+        try:
+            fingerprint = scene_fingerprint(request.minLon, request.minLat, request.maxLon, request.maxLat,
+                                            request.start_date, request.end_date)
+        except Exception as e:
+            print(f"Scene freshness check failed, falling back to TTL cache: {e}")
+    cached = get_cached_result(key, fingerprint)
+    if cached is not None:
+        return key, fingerprint, cached, False
+    return key, fingerprint, None, claim_job(key)
+
+
+def compute_shared_export(request: NdviRequest, key: str, fingerprint) -> dict:
+    """
+    Run the export for a job this worker has claimed and publish the result
+    """
+    # Raw getInfo responses, kept for offline replay when recording is enabled
+    recorded = [] if RECORD_PATH else None
+    error = None
+    try:
+        result = run_ndvi_export(
+            request.minLon,
+            request.minLat,
+            request.maxLon,
+            request.maxLat,
+            request.start_date,
+            request.end_date,
+            request.min_area,
+            thresholds=request.thresholds,
+            postprocess_executor=process_pool,
+            progressive=request.progressive,
+            on_coarse=coarse_sms_callback(request.mobile) if request.early_sms else None,
+            deadline_seconds=request.deadline_seconds or NDVI_DEADLINE_SECONDS,
+            recorded_responses=recorded,
+        )
+        if recorded is not None:
+            # Mobile numbers stay out of the archive, the chosen scale goes in so replays match
+            try:
+                record_exchange(dict(request.model_dump(exclude={"mobile"}), scale=result["scale"]),
+                                recorded, RECORD_PATH)
+            except Exception as e:
+                print(f"Failed to record the export for replay: {e}")
+        store_result(key, result, fingerprint)
+        try:
+            append_export(result, request.start_date, request.end_date)
+        except Exception as e:
+            print(f"Failed to append zones to the NDVI history: {e}")
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        # Never leave the job claimed, waiting workers would poll until it goes stale
+        finish_job(key, error=error)
+    return result
+
+
+async def run_shared_export(request: NdviRequest) -> dict:
+    """
+    Run the export once across all workers: reuse a cached result, wait for a
+    worker already computing the same request, or compute and publish it.
+    """
     loop = asyncio.get_event_loop()
-    ndvi_result = await loop.run_in_executor(
-        executor,
-        run_ndvi_export,
-        request.minLon,
-        request.minLat,
-        request.maxLon,
-        request.maxLat,
-        request.start_date,
-        request.end_date,
-        request.min_area,
-    )
+    key, fingerprint, cached, claimed = await loop.run_in_executor(executor, lookup_or_claim, request)
+    if cached is not None:
+        return cached
+
+    if not claimed:
+        result = await wait_for_result(key, fingerprint)
+        if result is not None:
+            return result
+        # The owning worker failed or died, take the job over
+        if not claim_job(key):
+            raise RuntimeError(f"NDVI job {key} is still owned by another worker")
+
+    return await loop.run_in_executor(executor, compute_shared_export, request, key, fingerprint)
+
+
+async def run_ndvi_and_notify(request: NdviRequest):
+    ndvi_result = await run_shared_export(request)
 
     pprint(ndvi_result)
 
@@ -78,8 +199,12 @@ async def run_ndvi_and_notify(request: NdviRequest):
         message = "No high NDVI zones found for your query."
     else:
         message_lines = [f"Found {count} high NDVI zones:"]
+        if ndvi_result["scale"] != 100:
+            message_lines[0] = f"Found {count} high NDVI zones ({ndvi_result['scale']} m detail):"
         for zone in results:
             line = f"NDVI: {zone['mean_ndvi']}, Area(ha): {zone['area_ha']}"
+            if len(ndvi_result["thresholds"]) > 1:
+                line = f"Band {zone['band']} (>{ndvi_result['thresholds'][zone['band'] - 1]}) " + line
             message_lines.append(line)
         message = "\n".join(message_lines)
 
@@ -92,7 +217,27 @@ async def run_ndvi_and_notify(request: NdviRequest):
 @app.post("/ndvi")
 async def ndvi_endpoint(request: NdviRequest, background_tasks: BackgroundTasks):
     background_tasks.add_task(run_ndvi_and_notify, request)
-    return {"status": "NDVI job started, SMS notification will be sent on completion."}
+    return {
+        "status": "NDVI job started, SMS notification will be sent on completion.",
+        "job_id": request_job_key(request),
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    job["cached"] = has_cached_result(job_id)
+    return job
+
+@app.get("/trend")
+async def trend(minLon: float, minLat: float, maxLon: float, maxLat: float,
+                days: int = Query(30, ge=1, le=TREND_MAX_DAYS),
+                until: Optional[date] = None):
+    trends = zone_trends(minLon, minLat, maxLon, maxLat, days=days, until=until)
+    return {"zones": trends, "sms": trend_sms(trends)}
+
 
 @app.get("/ping")
 async def ping():
@@ -0,0 +1,270 @@
+import struct
+import base64
+import zlib
+import lzma
+import os
+
+
+# Payload header byte: low nibble is the compression scheme, high nibble is the
+# preset dictionary version (only used by SCHEME_DEFLATE_DICT).
+# Legacy payloads start with the zlib header 0x78, whose low nibble (8) is never
+# used as a scheme id, so they are still recognised by the decoder.
+SCHEME_STORED = 0
+SCHEME_DEFLATE = 1
+SCHEME_DEFLATE_DICT = 2
+SCHEME_LZMA = 3
+LEGACY_ZLIB_HEADER = 0x78
+
+NDVI_DICT_PATH = os.getenv(
+    "NDVI_ZLIB_DICT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "ndvi_dict.bin")
+)
+
+# Set in the feature count field when the payload carries NDVI band thresholds
+# and a band tag per feature
+BANDED_FLAG = 0x8000
+
+LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 9 | lzma.PRESET_EXTREME}]
+
+_dict_cache = {}
+
+
+def load_preset_dict(path=None):
+    """
+    Load a trained preset dictionary, returns (version, dict_bytes) or None
+    """
+    path = path or NDVI_DICT_PATH
+    if path not in _dict_cache:
+        if not os.path.exists(path):
+            _dict_cache[path] = None
+        else:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            # File layout: 1 version byte (1-15) followed by the dictionary bytes
+            _dict_cache[path] = (raw[0], raw[1:]) if raw else None
+    return _dict_cache[path]
+
+
+def _deflate_raw(data, zdict=None):
+    if zdict:
+        c = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        c = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+    return c.compress(data) + c.flush()
+
+
+def _inflate_raw(data, zdict=None):
+    d = zlib.decompressobj(-15, zdict) if zdict else zlib.decompressobj(-15)
+    return d.decompress(data) + d.flush()
+
+
+def compress_ndvi_payload(data, schemes=None, preset_dict=None):
+    """
+    Try every available scheme and keep the smallest output, prefixed with the header byte
+    """
+    if schemes is None:
+        schemes = (SCHEME_STORED, SCHEME_DEFLATE, SCHEME_DEFLATE_DICT, SCHEME_LZMA)
+    if preset_dict is None:
+        preset_dict = load_preset_dict()
+
+    candidates = []
+    for scheme in schemes:
+        if scheme == SCHEME_STORED:
+            candidates.append(bytes([SCHEME_STORED]) + data)
+        elif scheme == SCHEME_DEFLATE:
+            candidates.append(bytes([SCHEME_DEFLATE]) + _deflate_raw(data))
+        elif scheme == SCHEME_DEFLATE_DICT:
+            if preset_dict is None:
+                continue
+            version, zdict = preset_dict
+            candidates.append(bytes([(version << 4) | SCHEME_DEFLATE_DICT]) + _deflate_raw(data, zdict))
+        elif scheme == SCHEME_LZMA:
+            candidates.append(bytes([SCHEME_LZMA]) + lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS))
+        else:
+            raise ValueError(f"Unknown compression scheme: {scheme}")
+
+    return min(candidates, key=len)
+
+
+def decompress_ndvi_payload(compressed, preset_dict=None):
+    """
+    Inverse of compress_ndvi_payload, also accepts legacy zlib payloads
+    """
+    header = compressed[0]
+    if header == LEGACY_ZLIB_HEADER:
+        return zlib.decompress(compressed)
+
+    scheme = header & 0x0F
+    body = compressed[1:]
+    if scheme == SCHEME_STORED:
+        return body
+    if scheme == SCHEME_DEFLATE:
+        return _inflate_raw(body)
+    if scheme == SCHEME_DEFLATE_DICT:
+        if preset_dict is None:
+            preset_dict = load_preset_dict()
+        version = header >> 4
+        if preset_dict is None or preset_dict[0] != version:
+            raise ValueError(f"Payload needs preset dictionary version {version}, which is not loaded")
+        return _inflate_raw(body, preset_dict[1])
+    if scheme == SCHEME_LZMA:
+        return lzma.decompress(body, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+    raise ValueError(f"Unknown compression scheme in header byte: {header:#04x}")
+
+
+def pack_ndvi_data(ref_point, features, thresholds=None):
+    """
+    Fixed-point, delta offsets, returns the uncompressed binary payload
+    """
+    data = bytearray()
+    # Pack ref_point as 2 floats (8 bytes)
+    data.extend(struct.pack('>2f', *ref_point))
+    # Number of features (unsigned short), top bit marks a banded payload
+    if thresholds is None:
+        data.extend(struct.pack('>H', len(features)))
+    else:
+        if not 0 < len(thresholds) <= 255 or not all(-32.767 <= t <= 32.767 for t in thresholds):
+            raise ValueError(f"Band thresholds must be 1-255 values in [-32.767, 32.767], got {thresholds}")
+        data.extend(struct.pack('>H', len(features) | BANDED_FLAG))
+        # Band thresholds, fixed-point like mean_ndvi
+        data.extend(struct.pack('>B', len(thresholds)))
+        for t in thresholds:
+            data.extend(struct.pack('>h', int(round(t * 1000))))
+
+    # Bands below a negative threshold can have a negative mean, banded payloads store it signed
+    mean_format = '>HH' if thresholds is None else '>hH'
+    for feat in features:
+        # Fixed-point encoding for mean_ndvi and area_ha
+        mean_int = int(round(feat['mean_ndvi'] * 1000))  # 0-1000, -1000-1000 when banded
+        area_int = int(round(feat['area_ha'] * 10))       # scale area by 10
+        data.extend(struct.pack(mean_format, mean_int, area_int))
+        if thresholds is not None:
+            # 1-based index of the highest threshold the zone exceeds
+            data.extend(struct.pack('>B', feat.get('band', 1)))
+
+        offsets = feat['offsets']
+        # Number of offset points
+        data.extend(struct.pack('>H', len(offsets)))
+
+        if not offsets:
+            continue
+
+        # Delta encode offsets
+        prev_dx, prev_dy = offsets[0]
+        data.extend(struct.pack('>2h', prev_dx, prev_dy))  # absolute first point
+
+        for dx, dy in offsets[1:]:
+            delta_dx = dx - prev_dx
+            delta_dy = dy - prev_dy
+            # Zig-zag encoding to handle signed deltas efficiently
+            zz_dx = (delta_dx << 1) ^ (delta_dx >> 15)
+            zz_dy = (delta_dy << 1) ^ (delta_dy >> 15)
+            # Store as unsigned shorts
+            data.extend(struct.pack('>HH', zz_dx, zz_dy))
+            prev_dx, prev_dy = dx, dy
+
+    return bytes(data)
+
+
+def unpack_ndvi_data(data):
+    """
+    Parse the uncompressed binary payload back to structured data
+    """
+    pos = 0
+    ref_point = struct.unpack('>2f', data[pos:pos+8])
+    pos += 8
+    count, = struct.unpack('>H', data[pos:pos+2])
+    pos += 2
+
+    thresholds = None
+    if count & BANDED_FLAG:
+        count &= ~BANDED_FLAG
+        n_thresholds = data[pos]
+        pos += 1
+        thresholds = [t / 1000.0 for t in struct.unpack(f'>{n_thresholds}h', data[pos:pos+2*n_thresholds])]
+        pos += 2 * n_thresholds
+
+    mean_format = '>HH' if thresholds is None else '>hH'
+    features = []
+    for _ in range(count):
+        mean_int, area_int = struct.unpack(mean_format, data[pos:pos+4])
+        pos += 4
+        mean_ndvi = mean_int / 1000.0
+        area_ha = area_int / 10.0
+        band = None
+        if thresholds is not None:
+            band = data[pos]
+            pos += 1
+
+        n_offsets, = struct.unpack('>H', data[pos:pos+2])
+        pos += 2
+
+        offsets = []
+        if n_offsets > 0:
+            # Read absolute first point
+            dx, dy = struct.unpack('>2h', data[pos:pos+4])
+            pos += 4
+            offsets.append([dx, dy])
+
+            prev_dx, prev_dy = dx, dy
+            for __ in range(n_offsets - 1):
+                zz_dx, zz_dy = struct.unpack('>HH', data[pos:pos+4])
+                pos += 4
+                # Decode zig-zag
+                delta_dx = (zz_dx >> 1) ^ (-(zz_dx & 1))
+                delta_dy = (zz_dy >> 1) ^ (-(zz_dy & 1))
+                dx = prev_dx + delta_dx
+                dy = prev_dy + delta_dy
+                offsets.append([dx, dy])
+                prev_dx, prev_dy = dx, dy
+
+        feature = {
+            'mean_ndvi': mean_ndvi,
+            'area_ha': area_ha,
+            'offsets': offsets
+        }
+        if band is not None:
+            feature['band'] = band
+        features.append(feature)
+
+    result = {'ref_point': ref_point, 'features': features}
+    if thresholds is not None:
+        result['thresholds'] = thresholds
+    return result
+
+
+def encode_ndvi_data_advanced(ref_point, features, schemes=None, thresholds=None):
+    """
+    Fixed-point, delta offsets, smallest of stored/deflate/deflate+dict/lzma, base85 encode.
+    Passing thresholds writes the banded format with a band tag per feature.
+    """
+    data = pack_ndvi_data(ref_point, features, thresholds)
+    compressed = compress_ndvi_payload(data, schemes)
+    # Encode with base85
+    encoded = base64.b85encode(compressed).decode('ascii')
+    return encoded
+
+
+def decode_ndvi_data_advanced(encoded_str):
+    """
+    Decode advanced compressed base85 string back to structured data
+    """
+    compressed = base64.b85decode(encoded_str)
+    data = decompress_ndvi_payload(compressed)
+    return unpack_ndvi_data(data)
+
+
+def read_payload_corpus(paths):
+    """
+    Read base85 payloads (one per line) from files or directories of files
+    """
+    payloads = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            files = [path]
+        for file_path in files:
+            with open(file_path, 'r') as f:
+                payloads.extend(line.strip() for line in f if line.strip())
+    return payloads
@@ -0,0 +1,154 @@
+import os
+import json
+import gzip
+import time
+import fcntl
+import asyncio
+import argparse
+import tempfile
+
+
+# When set, every export appends its request and raw getInfo responses here
+RECORD_PATH = os.getenv("NDVI_RECORD_PATH")
+
+EXPORT_FIELDS = ('minLon', 'minLat', 'maxLon', 'maxLat', 'start_date', 'end_date', 'min_area')
+
+
+def record_exchange(request, responses, path=None):
+    """
+    Append one request and its getInfo responses to a gzip JSONL archive.
+    Each call writes a separate gzip member, which gzip readers treat as one stream.
+    """
+    path = path or RECORD_PATH
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    line = json.dumps({'request': request, 'responses': responses, 'recorded_at': time.time()},
+                      separators=(',', ':'))
+    member = gzip.compress((line + "\n").encode('utf-8'))
+    # Several uvicorn workers may record at once, the lock keeps gzip members whole
+    with open(path, 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(member)
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_exchanges(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay_export(exchange, **kwargs):
+    """
+    Run run_ndvi_export's post-processing on a recorded exchange, no Earth Engine involved
+    """
+    from export_ndvi import run_ndvi_export
+
+    request = exchange['request']
+    return run_ndvi_export(
+        *(request[field] for field in EXPORT_FIELDS),
+        thresholds=request.get('thresholds'),
+        progressive=request.get('progressive', False),
+        # The recorded responses were computed at this scale, don't let the cost model pick another
+        scale=request.get('scale'),
+        replay_responses=exchange['responses'],
+        **kwargs
+    )
+
+
+def install_replay_stubs(state_dir, responses_for, sent=None, ee_latency=0.0, use_cache=True):
+    """
+    Import main with Earth Engine and TextSMS stubbed and its state kept in state_dir.
+    responses_for(args, kwargs) returns (responses, scale) for each run_ndvi_export call.
+    With use_cache=False every request runs its export instead of reusing a stored result.
+    """
+    # main loads TextSMS credentials at import, give it placeholders
+    if not os.getenv("TEXTSMS_CREDENTIALS_PATH"):
+        creds_path = os.path.join(state_dir, "textsms-creds.json")
+        with open(creds_path, 'w') as f:
+            json.dump({'apikey': 'replay', 'partnerID': 'replay', 'shortcode': 'replay'}, f)
+        os.environ["TEXTSMS_CREDENTIALS_PATH"] = creds_path
+    os.environ.pop("NDVI_RECORD_PATH", None)
+
+    import main
+    import job_store
+    import zone_store
+    from export_ndvi import run_ndvi_export
+
+    job_store.STATE_DB_PATH = os.path.join(state_dir, "ndvi_state.db")
+    zone_store.ZONE_STORE_PATH = os.path.join(state_dir, "zone_store")
+    main.RECORD_PATH = None
+    # The scene freshness check would query Earth Engine
+    main.SCENE_AWARE_CACHE = False
+
+    def replay_run_ndvi_export(*args, **kwargs):
+        responses, scale = responses_for(args, kwargs)
+        kwargs.pop('on_coarse', None)
+        kwargs['scale'] = scale
+        # Stand-in for the time spent waiting on Earth Engine
+        time.sleep(ee_latency)
+        return run_ndvi_export(*args, replay_responses=responses, **kwargs)
+
+    def capture_sms(mobile, message):
+        if sent is not None:
+            sent.append((mobile, message))
+        return True
+
+    main.run_ndvi_export = replay_run_ndvi_export
+    main.send_sms = capture_sms
+    if not use_cache:
+        main.get_cached_result = lambda key, fingerprint=None: None
+    return main
+
+
+def replay_notify(exchanges):
+    """
+    Drive run_ndvi_and_notify for every exchange with Earth Engine and TextSMS stubbed.
+    Returns the SMS messages that would have been sent.
+    """
+    state_dir = tempfile.mkdtemp(prefix="ndvi-replay-")
+    sent = []
+    current = {}
+
+    def responses_for(args, kwargs):
+        exchange = current['exchange']
+        return exchange['responses'], exchange['request'].get('scale')
+
+    # Exchanges run one at a time and in order, each serving its own recorded responses.
+    # Identical requests recorded at different times would otherwise be answered from the cache.
+    main = install_replay_stubs(state_dir, responses_for, sent, use_cache=False)
+    requests = [main.NdviRequest(mobile='replay', **e['request']) for e in exchanges]
+
+    async def run_all():
+        for request, exchange in zip(requests, exchanges):
+            current['exchange'] = exchange
+            await main.run_ndvi_and_notify(request)
+
+    asyncio.run(run_all())
+    return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded NDVI exports offline")
+    parser.add_argument("archive", help="gzip JSONL archive written with NDVI_RECORD_PATH")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the archive this many times")
+    parser.add_argument("--notify", action="store_true", help="Go through run_ndvi_and_notify with SMS stubbed and the result cache off, "
+                             "so every exchange runs its own recorded export")
+    args = parser.parse_args()
+
+    exchanges = load_exchanges(args.archive)
+    start = time.time()
+    if args.notify:
+        sent = []
+        for _ in range(args.repeat):
+            sent = replay_notify(exchanges)
+        for mobile, message in sent:
+            print(f"--> {mobile}\n{message}")
+    else:
+        zones = 0
+        for _ in range(args.repeat):
+            for exchange in exchanges:
+                zones += replay_export(exchange)['count']
+        print(f"{zones} zones")
+    elapsed = time.time() - start
+    runs = len(exchanges) * args.repeat
+    print(f"Replayed {runs} exports in {elapsed:.2f} s ({runs / elapsed:.1f}/s)")
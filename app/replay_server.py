@@ -0,0 +1,26 @@
+import os
+import zlib
+
+from replay import install_replay_stubs
+from bench_postprocess import synthetic_feature_collection
+
+# ASGI app for load tests: the real main app with Earth Engine answered by synthetic
+# FeatureCollections, after NDVI_STUB_EE_SECONDS if set. Every uvicorn worker shares the
+# state in NDVI_REPLAY_STATE_DIR, so cache and in-flight deduplication work across them.
+STATE_DIR = os.environ["NDVI_REPLAY_STATE_DIR"]
+EE_SECONDS = float(os.getenv("NDVI_STUB_EE_SECONDS", "0"))
+# One line per export actually run, to count how many duplicates were deduplicated
+EXPORT_LOG = os.path.join(STATE_DIR, "exports.log")
+
+
+def synthetic_responses(args, kwargs):
+    with open(EXPORT_LOG, 'a') as f:
+        f.write(f"{os.getpid()}\n")
+    minLon, minLat, maxLon, maxLat = (float(v) for v in args[:4])
+    ref_point = ((minLon + maxLon) / 2, (minLat + maxLat) / 2)
+    # Same request, same zones, in every worker process
+    seed = zlib.crc32(repr(args).encode('utf-8'))
+    return [synthetic_feature_collection(seed, ref_point=ref_point)], kwargs.get('scale')
+
+
+app = install_replay_stubs(STATE_DIR, synthetic_responses, ee_latency=EE_SECONDS).app
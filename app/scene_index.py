@@ -0,0 +1,84 @@
+import math
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+
+import ee
+
+from export_ndvi import CLD_THRESH, initialize_earth_engine
+from job_store import get_scene_lists, store_scene_lists
+
+# Scene lists are cached per 1 degree tile over this many days back from today
+SCENE_HISTORY_DAYS = 180
+# New acquisitions land every few days, an hour-old list is fresh enough
+SCENE_LIST_TTL_SECONDS = 3600
+TILE_DEGREES = 1
+
+
+def bbox_tiles(minLon, minLat, maxLon, maxLat):
+    """
+    Keys of the TILE_DEGREES grid cells the bbox touches, e.g. '36_-2'
+    """
+    return [f"{lon}_{lat}"
+            for lon in range(math.floor(minLon / TILE_DEGREES), math.floor(maxLon / TILE_DEGREES) + 1)
+            for lat in range(math.floor(minLat / TILE_DEGREES), math.floor(maxLat / TILE_DEGREES) + 1)]
+
+
+def tile_geometry(tile):
+    lon, lat = (int(v) for v in tile.split("_"))
+    return ee.Geometry.BBox(lon * TILE_DEGREES, lat * TILE_DEGREES,
+                            (lon + 1) * TILE_DEGREES, (lat + 1) * TILE_DEGREES)
+
+
+def fetch_tile_scenes(tiles, history_start, history_end, key_path=None):
+    """
+    Scene ids and acquisition times for several tiles in a single metadata query.
+    Only scenes whose cloud probability image is ingested count: the export joins the
+    two collections, and cloud probability often lands hours after the surface reflectance.
+    """
+    initialize_earth_engine(key_path)
+    s2_sr = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+             .filterDate(history_start, history_end)
+             .filter(ee.Filter.lte('CLOUDY_PIXEL_PERCENTAGE', CLD_THRESH)))
+    s2_cld = ee.ImageCollection('COPERNICUS/S2_CLOUD_PROBABILITY').filterDate(history_start, history_end)
+    same_scene = ee.Filter.equals(leftField='system:index', rightField='system:index')
+
+    def joined_scenes(tile):
+        geom = tile_geometry(tile)
+        joined = ee.Join.simple().apply(s2_sr.filterBounds(geom), s2_cld.filterBounds(geom), same_scene)
+        return ee.ImageCollection(joined).reduceColumns(
+            ee.Reducer.toList(2), ['system:index', 'system:time_start']).get('list')
+
+    per_tile = ee.Dictionary.fromLists(tiles, [joined_scenes(tile) for tile in tiles])
+    return {tile: [(scene_id, int(ms)) for scene_id, ms in scenes]
+            for tile, scenes in per_tile.getInfo().items()}
+
+
+def scene_fingerprint(minLon, minLat, maxLon, maxLat, start_date, end_date, key_path=None):
+    """
+    Hash of the usable Sentinel-2 scenes for the bbox and window. Unchanged fingerprint,
+    unchanged export result. Tiles are coarser than the bbox, so a scene next to the
+    bbox may change the fingerprint too, which only costs an extra recompute.
+    """
+    tiles = bbox_tiles(float(minLon), float(minLat), float(maxLon), float(maxLat))
+    start_ms = datetime.fromisoformat(str(start_date)).replace(tzinfo=timezone.utc).timestamp() * 1000
+    end_ms = datetime.fromisoformat(str(end_date)).replace(tzinfo=timezone.utc).timestamp() * 1000
+
+    history_end = date.today() + timedelta(days=1)
+    history_start = history_end - timedelta(days=SCENE_HISTORY_DAYS)
+    within_history = start_ms >= datetime.combine(history_start, datetime.min.time(), timezone.utc).timestamp() * 1000
+    if within_history:
+        cached = get_scene_lists(tiles, max_age=SCENE_LIST_TTL_SECONDS)
+    else:
+        # Window reaches past the cached history, query just this request's window
+        history_start = date.fromisoformat(str(start_date))
+        cached = {}
+
+    missing = [tile for tile in tiles if tile not in cached]
+    if missing:
+        fetched = fetch_tile_scenes(missing, history_start.isoformat(), history_end.isoformat(), key_path)
+        if within_history:
+            store_scene_lists(fetched)
+        cached.update(fetched)
+
+    scene_ids = sorted({scene_id for tile in tiles for scene_id, ms in cached[tile] if start_ms <= ms < end_ms})
+    return hashlib.sha1(",".join(scene_ids).encode('utf-8')).hexdigest()
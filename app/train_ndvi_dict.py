@@ -0,0 +1,51 @@
+import base64
+import argparse
+from collections import Counter
+
+from ndvi_codec import read_payload_corpus, decompress_ndvi_payload, NDVI_DICT_PATH
+
+
+def train_preset_dict(samples, dict_size=1024, ngram_sizes=(12, 8, 6, 4)):
+    """
+    Build a zlib preset dictionary from the substrings shared by the most payloads
+    """
+    picked = []
+    picked_size = 0
+    for n in ngram_sizes:
+        # Count each substring once per sample so one large payload can't dominate
+        counts = Counter()
+        for data in samples:
+            counts.update({data[i:i+n] for i in range(len(data) - n + 1)})
+
+        for gram, count in counts.most_common():
+            if count < 2 or picked_size + n > dict_size:
+                break
+            if any(gram in p for p in picked):
+                continue
+            picked.append(gram)
+            picked_size += n
+
+    # deflate finds matches closest to the end cheapest, so put the most common grams last
+    return b''.join(reversed(picked))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a zlib preset dictionary from archived NDVI payloads")
+    parser.add_argument("corpus", nargs="+", help="Files or directories with one base85 payload per line")
+    parser.add_argument("--size", type=int, default=1024, help="Dictionary size in bytes")
+    parser.add_argument("--version", type=int, default=1, help="Dictionary version (1-15), stored in each payload header")
+    parser.add_argument("--output", default=NDVI_DICT_PATH)
+    args = parser.parse_args()
+
+    if not 1 <= args.version <= 15:
+        parser.error("--version must be between 1 and 15")
+
+    payloads = read_payload_corpus(args.corpus)
+    samples = [decompress_ndvi_payload(base64.b85decode(p)) for p in payloads]
+    zdict = train_preset_dict(samples, args.size)
+
+    with open(args.output, "wb") as f:
+        f.write(bytes([args.version]) + zdict)
+
+    print(f"Trained {len(zdict)} byte dictionary (version {args.version}) from {len(samples)} payloads")
+    print(f"Saved to {args.output}")
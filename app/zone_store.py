@@ -0,0 +1,325 @@
+import os
+import array
+import fcntl
+import random
+import time
+from datetime import date, timedelta
+
+
+# Per-zone NDVI history, one directory per partition: <epsg>_<tile x>_<tile y>/<YYYY-MM>/
+# Each column is its own append-only binary file, partitions are small enough to read whole.
+ZONE_STORE_PATH = os.getenv("NDVI_ZONE_STORE", os.path.join("output", "zone_store"))
+GRID_SPACING = 100
+# Partition tiles are 1000 x 1000 grid cells (100 km)
+TILE_CELLS = 1000
+# Share of the smaller zone's cells that must overlap for two runs' zones to be the same zone
+MATCH_OVERLAP = 0.3
+
+COLUMNS = (
+    ('zone_id', 'q'),
+    ('recorded_at', 'd'),
+    ('start_day', 'i'),
+    ('end_day', 'i'),
+    ('mean_ndvi', 'f'),
+    ('area_ha', 'f'),
+    ('band', 'i'),
+    ('min_gx', 'i'),
+    ('min_gy', 'i'),
+    ('max_gx', 'i'),
+    ('max_gy', 'i'),
+    ('vertex_start', 'q'),
+    ('vertex_count', 'i'),
+)
+# Variable-length column: absolute grid vertices as int32 x, y pairs
+VERTEX_COLUMN = ('vertices', 'i')
+
+
+def partition_path(epsg, tx, ty, month, root=None):
+    return os.path.join(root or ZONE_STORE_PATH, f"{epsg}_{tx}_{ty}", month)
+
+
+def month_key(day):
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def months_between(start, end):
+    months = []
+    current = date(start.year, start.month, 1)
+    while current <= end:
+        months.append(month_key(current))
+        current = (current + timedelta(days=32)).replace(day=1)
+    return months
+
+
+def read_column(path, typecode):
+    """
+    Column file as a memoryview. Read whole and closed right away, keeping maps open
+    per column file would hold a file descriptor for every partition ever queried.
+    """
+    values = array.array(typecode)
+    if not os.path.exists(path):
+        return memoryview(values)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # A writer may be mid-append, drop a trailing partial value
+    values.frombytes(data[:len(data) - len(data) % values.itemsize])
+    return memoryview(values)
+
+
+def read_partition(path):
+    """
+    Dict of column name -> memoryview, rows aligned across columns
+    """
+    columns = {name: read_column(os.path.join(path, name + '.bin'), typecode) for name, typecode in COLUMNS}
+    # A writer may be mid-append, only expose rows every column already has
+    rows = min(len(col) for col in columns.values())
+    return {name: col[:rows] for name, col in columns.items()}, rows
+
+
+def polygon_cells(vertices):
+    """
+    Grid cells whose centre lies inside the polygon (vertices in grid units)
+    """
+    ys = [y for _, y in vertices]
+    n = len(vertices)
+    cells = set()
+    for j in range(min(ys), max(ys)):
+        cy = j + 0.5
+        # Crossings of the row centre line, sorted, give the inside spans
+        crossings = []
+        for k in range(n):
+            (x1, y1), (x2, y2) = vertices[k], vertices[(k + 1) % n]
+            if (y1 > cy) != (y2 > cy):
+                crossings.append(x1 + (cy - y1) * (x2 - x1) / (y2 - y1))
+        crossings.sort()
+        for a, b in zip(crossings[::2], crossings[1::2]):
+            for i in range(int(round(a)), int(round(b))):
+                if a <= i + 0.5 <= b:
+                    cells.add((i, j))
+    return cells
+
+
+def grid_zones(ref_point, features):
+    """
+    Convert export features (offsets relative to ref_point) to absolute grid vertices
+    in the UTM zone of ref_point, so zones line up across runs with different bboxes
+    """
+    from pyproj import Transformer
+    from export_ndvi import get_utm_crs
+
+    utm_crs = get_utm_crs(*ref_point)
+    ref_x, ref_y = Transformer.from_crs("epsg:4326", utm_crs, always_xy=True).transform(*ref_point)
+    base_x, base_y = round(ref_x / GRID_SPACING), round(ref_y / GRID_SPACING)
+    zones = []
+    for feat in features:
+        if not feat['offsets']:
+            continue
+        zones.append({
+            'mean_ndvi': feat['mean_ndvi'],
+            'area_ha': feat['area_ha'],
+            'band': feat.get('band', 1),
+            'vertices': [(base_x + dx, base_y + dy) for dx, dy in feat['offsets']],
+        })
+    return utm_crs.to_epsg(), zones
+
+
+def latest_zones(epsg, min_gx, min_gy, max_gx, max_gy, months, root=None):
+    """
+    Most recent row of every stored zone whose bbox overlaps the query bbox
+    """
+    latest = {}
+    # A zone is stored in the tile of its bbox min corner, which can sit one tile down/left
+    for tx in range(min_gx // TILE_CELLS - 1, max_gx // TILE_CELLS + 1):
+        for ty in range(min_gy // TILE_CELLS - 1, max_gy // TILE_CELLS + 1):
+            for month in months:
+                path = partition_path(epsg, tx, ty, month, root)
+                if not os.path.isdir(path):
+                    continue
+                cols, rows = read_partition(path)
+                vertices = read_column(os.path.join(path, VERTEX_COLUMN[0] + '.bin'), VERTEX_COLUMN[1])
+                for r in range(rows):
+                    if (cols['max_gx'][r] < min_gx or cols['min_gx'][r] > max_gx or
+                            cols['max_gy'][r] < min_gy or cols['min_gy'][r] > max_gy):
+                        continue
+                    zone_id = cols['zone_id'][r]
+                    if zone_id in latest and latest[zone_id]['end_day'] >= cols['end_day'][r]:
+                        continue
+                    start, count = cols['vertex_start'][r], cols['vertex_count'][r]
+                    flat = vertices[start * 2:(start + count) * 2]
+                    latest[zone_id] = {
+                        'end_day': cols['end_day'][r],
+                        'vertices': list(zip(flat[::2], flat[1::2])),
+                    }
+    return latest
+
+
+def append_zones(epsg, zones, start_date, end_date, root=None):
+    """
+    Match zones to stored zones by grid overlap and append one row each. Returns zone ids.
+    """
+    start_day = date.fromisoformat(str(start_date))
+    end_day = date.fromisoformat(str(end_date))
+    month = month_key(end_day)
+    # Match against this month and the previous one, zones seen longer ago start fresh
+    match_months = months_between(end_day - timedelta(days=31), end_day)
+
+    used = set()
+    zone_ids = []
+    for zone in zones:
+        xs = [x for x, _ in zone['vertices']]
+        ys = [y for _, y in zone['vertices']]
+        zone['bbox'] = (min(xs), min(ys), max(xs), max(ys))
+        cells = polygon_cells(zone['vertices'])
+        best_id, best_overlap = None, MATCH_OVERLAP
+        for zone_id, stored in latest_zones(epsg, *zone['bbox'], match_months, root).items():
+            if zone_id in used:
+                continue
+            stored_cells = polygon_cells(stored['vertices'])
+            if not cells or not stored_cells:
+                continue
+            overlap = len(cells & stored_cells) / min(len(cells), len(stored_cells))
+            if overlap >= best_overlap:
+                best_id, best_overlap = zone_id, overlap
+        if best_id is None:
+            best_id = random.getrandbits(63)
+        used.add(best_id)
+        zone_ids.append(best_id)
+
+    now = time.time()
+    by_partition = {}
+    for zone, zone_id in zip(zones, zone_ids):
+        tx, ty = zone['bbox'][0] // TILE_CELLS, zone['bbox'][1] // TILE_CELLS
+        by_partition.setdefault(partition_path(epsg, tx, ty, month, root), []).append((zone, zone_id))
+
+    for path, rows in by_partition.items():
+        os.makedirs(path, exist_ok=True)
+        # Several workers may append to one partition, keep all columns in step
+        with open(os.path.join(path, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            vertex_path = os.path.join(path, VERTEX_COLUMN[0] + '.bin')
+            vertex_start = (os.path.getsize(vertex_path) if os.path.exists(vertex_path) else 0) // 8
+            columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+            vertices = array.array(VERTEX_COLUMN[1])
+            for zone, zone_id in rows:
+                values = {
+                    'zone_id': zone_id,
+                    'recorded_at': now,
+                    'start_day': start_day.toordinal(),
+                    'end_day': end_day.toordinal(),
+                    'mean_ndvi': zone['mean_ndvi'],
+                    'area_ha': zone['area_ha'],
+                    'band': zone['band'],
+                    'min_gx': zone['bbox'][0],
+                    'min_gy': zone['bbox'][1],
+                    'max_gx': zone['bbox'][2],
+                    'max_gy': zone['bbox'][3],
+                    'vertex_start': vertex_start,
+                    'vertex_count': len(zone['vertices']),
+                }
+                for name, _ in COLUMNS:
+                    columns[name].append(values[name])
+                for x, y in zone['vertices']:
+                    vertices.extend((x, y))
+                vertex_start += len(zone['vertices'])
+            # Vertices first, so rows never point past the end of the vertex column
+            with open(vertex_path, 'ab') as f:
+                f.write(vertices.tobytes())
+            for name, _ in COLUMNS:
+                with open(os.path.join(path, name + '.bin'), 'ab') as f:
+                    f.write(columns[name].tobytes())
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return zone_ids
+
+
+def append_export(result, start_date, end_date, root=None):
+    """
+    Store the zones of one run_ndvi_export result
+    """
+    epsg, zones = grid_zones(result['ref_point'], result['results'])
+    return append_zones(epsg, zones, start_date, end_date, root)
+
+
+def query_trends(epsg, min_gx, min_gy, max_gx, max_gy, start_day, end_day, root=None):
+    """
+    Per-zone trajectories, (end_date, mean_ndvi, area_ha) sorted by date, for zones
+    overlapping the grid bbox with windows ending between start_day and end_day
+    """
+    start_ord, end_ord = start_day.toordinal(), end_day.toordinal()
+    trajectories = {}
+    for tx in range(min_gx // TILE_CELLS - 1, max_gx // TILE_CELLS + 1):
+        for ty in range(min_gy // TILE_CELLS - 1, max_gy // TILE_CELLS + 1):
+            for month in months_between(start_day, end_day):
+                path = partition_path(epsg, tx, ty, month, root)
+                if not os.path.isdir(path):
+                    continue
+                cols, rows = read_partition(path)
+                end_days = cols['end_day']
+                for r in range(rows):
+                    if not start_ord <= end_days[r] <= end_ord:
+                        continue
+                    if (cols['max_gx'][r] < min_gx or cols['min_gx'][r] > max_gx or
+                            cols['max_gy'][r] < min_gy or cols['min_gy'][r] > max_gy):
+                        continue
+                    trajectories.setdefault(cols['zone_id'][r], []).append(
+                        (end_days[r], cols['mean_ndvi'][r], cols['area_ha'][r]))
+
+    trends = []
+    for zone_id, points in trajectories.items():
+        points.sort()
+        trends.append({
+            'zone_id': zone_id,
+            'points': [{'end_date': date.fromordinal(d).isoformat(), 'mean_ndvi': round(ndvi, 3),
+                        'area_ha': round(area, 1)} for d, ndvi, area in points],
+            'ndvi_per_week': ndvi_slope(points) * 7,
+        })
+    trends.sort(key=lambda t: -t['points'][-1]['area_ha'])
+    return trends
+
+
+def ndvi_slope(points):
+    """
+    Least-squares NDVI change per day
+    """
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mean_d = sum(p[0] for p in points) / n
+    mean_v = sum(p[1] for p in points) / n
+    var = sum((p[0] - mean_d) ** 2 for p in points)
+    if var == 0:
+        return 0.0
+    return sum((p[0] - mean_d) * (p[1] - mean_v) for p in points) / var
+
+
+def bbox_to_grid(minLon, minLat, maxLon, maxLat):
+    from pyproj import Transformer
+    from export_ndvi import get_utm_crs
+
+    center = ((float(minLon) + float(maxLon)) / 2, (float(minLat) + float(maxLat)) / 2)
+    utm_crs = get_utm_crs(*center)
+    transformer = Transformer.from_crs("epsg:4326", utm_crs, always_xy=True)
+    xs, ys = transformer.transform([float(minLon), float(maxLon), float(maxLon), float(minLon)],
+                                   [float(minLat), float(minLat), float(maxLat), float(maxLat)])
+    return (utm_crs.to_epsg(), int(min(xs) // GRID_SPACING), int(min(ys) // GRID_SPACING),
+            int(max(xs) // GRID_SPACING) + 1, int(max(ys) // GRID_SPACING) + 1)
+
+
+def zone_trends(minLon, minLat, maxLon, maxLat, days=30, until=None, root=None):
+    end_day = date.fromisoformat(str(until)) if until else date.today()
+    return query_trends(*bbox_to_grid(minLon, minLat, maxLon, maxLat),
+                        end_day - timedelta(days=days), end_day, root)
+
+
+def trend_sms(trends, limit=5):
+    """
+    Compact SMS text, one line per zone: first -> last NDVI and the direction
+    """
+    if not trends:
+        return "No NDVI history for this area yet."
+    lines = [f"NDVI trend, {len(trends)} zones:"]
+    for i, trend in enumerate(trends[:limit], 1):
+        first, last = trend['points'][0], trend['points'][-1]
+        slope = trend['ndvi_per_week']
+        direction = "greening" if slope > 0.01 else "drying" if slope < -0.01 else "stable"
+        lines.append(f"{i}. {first['mean_ndvi']:.2f}->{last['mean_ndvi']:.2f} {direction}, {last['area_ha']:.0f}ha")
+    return "\n".join(lines)
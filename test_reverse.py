@@ -1,55 +1,12 @@
-import struct
-import base64
-import zlib
+import os
+import sys
 import json
 from shapely.geometry import Polygon, mapping
 from pyproj import Transformer, CRS
 import pandas as pd
 
-def decode_ndvi_data_advanced(encoded_str):
-    compressed = base64.b85decode(encoded_str)
-    data = zlib.decompress(compressed)
-
-    pos = 0
-    ref_point = struct.unpack('>2f', data[pos:pos+8])
-    pos += 8
-    count, = struct.unpack('>H', data[pos:pos+2])
-    pos += 2
-
-    features = []
-    for _ in range(count):
-        mean_int, area_int = struct.unpack('>HH', data[pos:pos+4])
-        pos += 4
-        mean_ndvi = mean_int / 1000.0
-        area_ha = area_int / 10.0
-
-        n_offsets, = struct.unpack('>H', data[pos:pos+2])
-        pos += 2
-
-        offsets = []
-        if n_offsets > 0:
-            dx, dy = struct.unpack('>2h', data[pos:pos+4])
-            pos += 4
-            offsets.append([dx, dy])
-
-            prev_dx, prev_dy = dx, dy
-            for __ in range(n_offsets - 1):
-                zz_dx, zz_dy = struct.unpack('>HH', data[pos:pos+4])
-                pos += 4
-                delta_dx = (zz_dx >> 1) ^ (-(zz_dx & 1))
-                delta_dy = (zz_dy >> 1) ^ (-(zz_dy & 1))
-                dx = prev_dx + delta_dx
-                dy = prev_dy + delta_dy
-                offsets.append([dx, dy])
-                prev_dx, prev_dy = dx, dy
-
-        features.append({
-            'mean_ndvi': mean_ndvi,
-            'area_ha': area_ha,
-            'offsets': offsets
-        })
-
-    return {'ref_point': ref_point, 'features': features}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+from ndvi_codec import decode_ndvi_data_advanced
 
 def get_utm_crs(lon, lat):
     if 33 <= lon < 39: